@@ -1,3 +1,8 @@
+import asyncio
+import functools
+import heapq
+import itertools
+import logging
 import time
 
 from astrbot.api import AstrBotConfig, logger
@@ -7,17 +12,64 @@ from astrbot.api.provider import ProviderRequest
 from astrbot.api.star import Context, Star, register
 
 
+@functools.lru_cache(maxsize=256)
+def _fmt_time(ts):
+    """格式化墙上时钟时间戳（同一解禁时间只格式化一次，仅在日志守卫内调用）"""
+    return time.ctime(ts)
+
+
+@functools.lru_cache(maxsize=2048)
+def _normalize_user_id(user_id):
+    """统一用户ID格式（处理整数/字符串，结果按原始值缓存）"""
+    original = user_id
+    if isinstance(user_id, int):
+        normalized = str(user_id)
+    elif isinstance(user_id, str):
+        # 移除可能的前缀（如"qq_"）；rpartition避免无下划线时的列表分配
+        if "_" in user_id:
+            normalized = user_id.rpartition("_")[2].strip()
+        else:
+            normalized = user_id.strip()
+    else:
+        normalized = str(user_id)
+    logger.debug("用户ID规范化：原始=%s → 规范化后=%s", original, normalized)
+    return normalized
+
+
 @register("astrbot_plugin_LLMTempBan", "长安某", "llm临时拉黑屏蔽工具", "1.0.2")
 class BlacklistPlugin(Star):
     def __init__(self, context: Context, config: AstrBotConfig):
         super().__init__(context)
         self.config = config
-        self.temporary_blacklist = {}  # 临时黑名单：{用户ID: 解禁时间戳}
+        # 临时黑名单：{用户ID: (单调时钟解禁时间, 墙上时钟解禁时间)}
+        # 到期判断用单调时钟，避免NTP校时/系统休眠导致提前解禁或超期封禁；
+        # 墙上时钟仅用于日志展示
+        self.temporary_blacklist = {}
+        # 到期时间最小堆：[(单调时钟解禁时间, 用户ID)]，供后台任务批量清理；
+        # 条目被覆盖（重复拉黑）时堆中旧记录作废，弹出时按当前字典值校验。
+        # 扩展备注：若单实例活跃封禁量达到万级，可将本结构改为SoA布局
+        # （ID列表 + array.array('d')到期时间 + ID→下标映射），用连续double
+        # 数组做整批到期扫描；当前规模下dict+堆已是O(log n)主动清理，
+        # 且无需引入额外依赖，故不默认启用
+        self._expiry_heap = []
+        self._expiry_task = None
 
-        # 从配置加载管理员列表（Web面板配置）
-        self.administrators = self.config.get("administrators", [])
         # 初始化时暂存Bot ID（首次处理消息时更新）
         self.bot_id = ""
+        self._bot_initialized = False
+        self._bot_registered = False
+
+        # 配置延迟保存状态（避免在消息处理热路径上同步写盘）
+        self._config_dirty = False
+        self._save_task = None
+
+        # 从配置加载管理员列表（Web面板配置），内存中用set保证O(1)成员判断；
+        # 手工编辑配置可能引入重复项，加载时去重并回写
+        raw_administrators = self.config.get("administrators", [])
+        self.administrators = set(raw_administrators)
+        if len(self.administrators) != len(raw_administrators):
+            logger.info("管理员列表存在重复项，已去重")
+            self._schedule_save()
 
         # 从配置加载默认拉黑时长
         self.default_blacklist_duration = self.config.get(
@@ -30,53 +82,89 @@ class BlacklistPlugin(Star):
 
     def _get_bot_id(self, event: AstrMessageEvent):
         """通过消息事件获取Bot ID（符合API结构：AstrBotMessage.self_id）"""
-        if not self.bot_id:
+        if not self._bot_initialized:
             # 从事件的消息对象中提取Bot ID（AstrBotMessage.self_id）
             raw_bot_id = event.message_obj.self_id
             self.bot_id = self._normalize_user_id(raw_bot_id)
             logger.info(f"获取到Bot ID: 原始={raw_bot_id}, 规范化后={self.bot_id}")
             # 首次获取Bot ID后，自动添加到管理员列表
             self._add_bot_to_administrators()
+            self._bot_initialized = True
         return self.bot_id
 
     def _add_bot_to_administrators(self):
         """将Bot ID添加到管理员列表（去重并持久化）"""
+        # 快路径：Bot已注册为管理员后直接返回，跳过成员判断
+        if self._bot_registered:
+            return
         if self.bot_id and self.bot_id not in self.administrators:
-            self.administrators.append(self.bot_id)
+            self.administrators.add(self.bot_id)
             logger.info(f"Bot ID {self.bot_id} 已添加为管理员，更新后管理员列表: {self.administrators}")
-            # 保存到配置文件
-            self.config["administrators"] = self.administrators
-            self.config.save_config()
+            # 延迟保存到配置文件（配置中仍以列表形式持久化）
+            self._schedule_save()
+            self._bot_registered = True
         elif self.bot_id:
             logger.info(f"Bot ID {self.bot_id} 已在管理员列表中")
+            self._bot_registered = True
+
+    def _schedule_save(self):
+        """标记配置待保存，并在短暂防抖后异步写盘（合并连续修改）"""
+        self._config_dirty = True
+        if self._save_task is None or self._save_task.done():
+            try:
+                self._save_task = asyncio.create_task(self._debounced_save(1.0))
+            except RuntimeError:
+                # 初始化阶段可能没有运行中的事件循环，退回同步保存
+                self.config["administrators"] = list(self.administrators)
+                self.config.save_config()
+                self._config_dirty = False
+
+    async def _debounced_save(self, delay: float):
+        """防抖保存：等待delay秒后一次性落盘，避免热路径同步文件I/O"""
+        await asyncio.sleep(delay)
+        if self._config_dirty:
+            self.config["administrators"] = list(self.administrators)
+            self.config.save_config()
+            self._config_dirty = False
+            logger.debug("管理员配置已延迟保存")
 
     @filter.on_llm_request()
     async def check_blacklist_before_llm(
         self, event: AstrMessageEvent, req: ProviderRequest
     ):
         '''拦截黑名单用户的LLM请求'''
-        self._get_bot_id(event)
+        # 初始化完成后直接读取缓存的Bot ID，省去每条消息一次函数调用
+        _ = self.bot_id or self._get_bot_id(event)
+
+        # 热路径：实例属性提升为局部变量（LOAD_FAST快于LOAD_ATTR）；
+        # 配置项已在__init__缓存为属性，热路径不应再触碰self.config
+        blacklist = self.temporary_blacklist
+
+        # 快路径：黑名单为空（常态）时无需规范化ID和权限判断
+        if not blacklist:
+            return
 
         raw_user_id = event.message_obj.sender.user_id
         user_id = self._normalize_user_id(raw_user_id)
-        logger.debug(f"检查用户LLM请求权限: 原始ID={raw_user_id}, 规范化ID={user_id}")
+        logger.debug("检查用户LLM请求权限: 原始ID=%s, 规范化ID=%s", raw_user_id, user_id)
 
         # 管理员不受限制
         if user_id in self.administrators:
-            logger.debug(f"用户 {user_id} 是管理员，允许LLM请求")
+            logger.debug("用户 %s 是管理员，允许LLM请求", user_id)
             return
 
         # 拦截黑名单用户（未到解禁时间）
-        if user_id in self.temporary_blacklist:
-            unblock_time = self.temporary_blacklist[user_id]
-            current_time = time.time()
-            if current_time < unblock_time:
+        if user_id in blacklist:
+            unblock_mono, unblock_wall = blacklist[user_id]
+            now = time.monotonic()
+            if now < unblock_mono:
                 event.stop_event()
-                logger.info(f"已拦截黑名单用户 {user_id} 的LLM请求（解禁时间：{time.ctime(unblock_time)}）")
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info("已拦截黑名单用户 %s 的LLM请求（解禁时间：%s）", user_id, _fmt_time(unblock_wall))
             else:
                 # 自动移除已过期的黑名单记录
-                del self.temporary_blacklist[user_id]
-                logger.info(f"用户 {user_id} 的拉黑已过期，自动移除黑名单")
+                del blacklist[user_id]
+                logger.info("用户 %s 的拉黑已过期，自动移除黑名单", user_id)
 
     @filter.llm_tool(name="add_temporary_blacklist")
     async def handle_blacklist_request(
@@ -84,31 +172,34 @@ class BlacklistPlugin(Star):
     ):
         """处理拉黑请求（通过事件获取Bot ID）"""
         logger.info("收到拉黑请求，开始处理...")
+        # 处理时长（先校验，无效请求直接返回，不再解析ID和消息链）
+        if duration_minutes is None:
+            duration_minutes = self.default_blacklist_duration
+            logger.info("未指定拉黑时长，使用默认值: %s 分钟", duration_minutes)
+        elif duration_minutes <= 0:
+            logger.warning("拉黑请求失败：时长 %s 分钟无效（必须大于0）", duration_minutes)
+            return
+        else:
+            logger.info("指定拉黑时长: %s 分钟", duration_minutes)
+
         # 获取Bot ID（确保已初始化）
         bot_id = self._get_bot_id(event)
-        
+
         # 解析发送者ID
         raw_sender_id = event.message_obj.sender.user_id
         sender_id = self._normalize_user_id(raw_sender_id)
-        logger.info(f"拉黑请求发送者: 原始ID={raw_sender_id}, 规范化ID={sender_id}")
-        
+        logger.info("拉黑请求发送者: 原始ID=%s, 规范化ID=%s", raw_sender_id, sender_id)
+
         # 解析目标用户ID
         target_id = self._extract_target_user(event.message_obj.message, bot_id)
-        logger.info(f"拉黑请求目标用户: {target_id if target_id else '未指定'}")
-        
-        # 处理时长
-        if duration_minutes is None:
-            duration_minutes = self.default_blacklist_duration
-            logger.info(f"未指定拉黑时长，使用默认值: {duration_minutes} 分钟")
-        else:
-            logger.info(f"指定拉黑时长: {duration_minutes} 分钟")
+        logger.info("拉黑请求目标用户: %s", target_id if target_id else "未指定")
 
         # 按发送者权限执行逻辑
         if sender_id in self.administrators:
-            logger.info(f"发送者 {sender_id} 是管理员，执行管理员拉黑逻辑")
+            logger.info("发送者 %s 是管理员，执行管理员拉黑逻辑", sender_id)
             await self._handle_admin_blacklist(target_id, duration_minutes)
         else:
-            logger.info(f"发送者 {sender_id} 是普通用户，执行普通用户拉黑逻辑")
+            logger.info("发送者 %s 是普通用户，执行普通用户拉黑逻辑", sender_id)
             await self._handle_normal_user_blacklist(
                 sender_id, target_id, duration_minutes
             )
@@ -123,18 +214,19 @@ class BlacklistPlugin(Star):
 
         raw_target_id = event.message_obj.sender.user_id
         target_id = self._normalize_user_id(raw_target_id)
-        logger.info(f"自动拉黑目标用户: 原始ID={raw_target_id}, 规范化ID={target_id}")
+        logger.info("自动拉黑目标用户: 原始ID=%s, 规范化ID=%s", raw_target_id, target_id)
 
         if target_id in self.administrators:
-            logger.warning(f"拒绝自动拉黑管理员 {target_id}（管理员不受自动拉黑限制）")
+            logger.warning("拒绝自动拉黑管理员 %s（管理员不受自动拉黑限制）", target_id)
             return
 
         if duration_minutes is None:
             duration_minutes = self.default_blacklist_duration
-            logger.info(f"未指定自动拉黑时长，使用默认值: {duration_minutes} 分钟")
+            logger.info("未指定自动拉黑时长，使用默认值: %s 分钟", duration_minutes)
 
         self._add_to_blacklist(target_id, duration_minutes)
-        logger.info(f"已自动拉黑违规用户 {target_id}，时长 {duration_minutes} 分钟（解禁时间：{time.ctime(self.temporary_blacklist[target_id])}）")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("已自动拉黑违规用户 %s，时长 %s 分钟（解禁时间：%s）", target_id, duration_minutes, _fmt_time(self.temporary_blacklist[target_id][1]))
 
     async def _handle_admin_blacklist(self, target_id, duration):
         """管理员拉黑逻辑"""
@@ -145,75 +237,134 @@ class BlacklistPlugin(Star):
         
         # 校验目标是否为管理员
         if target_id in self.administrators:
-            logger.warning(f"管理员拉黑失败：目标用户 {target_id} 是管理员（不能拉黑管理员）")
+            logger.warning("管理员拉黑失败：目标用户 %s 是管理员（不能拉黑管理员）", target_id)
             return
         
         # 校验时长
         if duration <= 0:
-            logger.warning(f"管理员拉黑失败：时长 {duration} 分钟无效（必须大于0）")
+            logger.warning("管理员拉黑失败：时长 %s 分钟无效（必须大于0）", duration)
             return
 
         # 执行拉黑
         self._add_to_blacklist(target_id, duration)
-        logger.info(f"管理员操作成功：用户 {target_id} 已被拉黑 {duration} 分钟（解禁时间：{time.ctime(self.temporary_blacklist[target_id])}）")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("管理员操作成功：用户 %s 已被拉黑 %s 分钟（解禁时间：%s）", target_id, duration, _fmt_time(self.temporary_blacklist[target_id][1]))
 
     async def _handle_normal_user_blacklist(self, sender_id, target_id, duration):
         """普通用户拉黑逻辑"""
         # 未指定目标时默认拉黑自己
         if not target_id:
             target_id = sender_id
-            logger.info(f"普通用户 {sender_id} 未指定拉黑目标，默认处理为拉黑自己")
+            logger.info("普通用户 %s 未指定拉黑目标，默认处理为拉黑自己", sender_id)
 
         # 校验时长
         if duration <= 0:
-            logger.warning(f"普通用户 {sender_id} 拉黑失败：时长 {duration} 分钟无效（必须大于0）")
+            logger.warning("普通用户 %s 拉黑失败：时长 %s 分钟无效（必须大于0）", sender_id, duration)
             return
 
         # 尝试拉黑管理员 → 反拉黑发起者
+        # （target_id不可能是Bot自身：_extract_target_user已过滤@Bot，
+        # 此处只针对人类管理员）
         if target_id in self.administrators:
             actual_duration = max(5, duration)  # 反拉黑时长至少5分钟
             self._add_to_blacklist(sender_id, actual_duration)
-            logger.info(
-                f"普通用户 {sender_id} 尝试拉黑管理员 {target_id}，已被反拉黑 {actual_duration} 分钟（解禁时间：{time.ctime(self.temporary_blacklist[sender_id])}）"
-            )
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(
+                    "普通用户 %s 尝试拉黑管理员 %s，已被反拉黑 %s 分钟（解禁时间：%s）",
+                    sender_id,
+                    target_id,
+                    actual_duration,
+                    _fmt_time(self.temporary_blacklist[sender_id][1]),
+                )
         # 仅允许拉黑自己
         elif target_id == sender_id:
             self._add_to_blacklist(sender_id, duration)
-            logger.info(f"普通用户自助拉黑成功：{sender_id} 已拉黑自己 {duration} 分钟（解禁时间：{time.ctime(self.temporary_blacklist[sender_id])}）")
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("普通用户自助拉黑成功：%s 已拉黑自己 %s 分钟（解禁时间：%s）", sender_id, duration, _fmt_time(self.temporary_blacklist[sender_id][1]))
         else:
-            logger.warning(f"普通用户 {sender_id} 拉黑失败：仅允许拉黑自己（尝试拉黑他人 {target_id} 被拒绝）")
+            logger.warning("普通用户 %s 拉黑失败：仅允许拉黑自己（尝试拉黑他人 %s 被拒绝）", sender_id, target_id)
+
+    # 每次插入时最多顺带扫描的条目数（摊还O(1)）
+    _LAZY_EXPIRE_SCAN_LIMIT = 16
 
     def _add_to_blacklist(self, user_id, duration_minutes):
-        """添加用户到黑名单（计算解禁时间）"""
-        unblock_time = time.time() + duration_minutes * 60
-        self.temporary_blacklist[user_id] = unblock_time
-        logger.debug(f"黑名单更新：{user_id} → 解禁时间戳={unblock_time}")
+        """添加用户到黑名单（单调时钟计算解禁时间，顺带惰性清理过期条目）"""
+        now_mono = time.monotonic()
+        # 惰性过期：插入时扫描有限数量的条目，清除其中已过期的记录，
+        # 避免黑名单字典随历史拉黑用户数无限增长
+        expired = [
+            uid
+            for uid, (unblock_mono, _) in itertools.islice(
+                self.temporary_blacklist.items(), self._LAZY_EXPIRE_SCAN_LIMIT
+            )
+            if unblock_mono <= now_mono
+        ]
+        for uid in expired:
+            del self.temporary_blacklist[uid]
+
+        duration_seconds = duration_minutes * 60
+        unblock_mono = now_mono + duration_seconds
+        unblock_wall = time.time() + duration_seconds
+        self.temporary_blacklist[user_id] = (unblock_mono, unblock_wall)
+        heapq.heappush(self._expiry_heap, (unblock_mono, user_id))
+        self._ensure_expiry_task()
+        if logger.isEnabledFor(logging.DEBUG):
+            if expired:
+                logger.debug(f"惰性清理过期黑名单条目：{expired}")
+            logger.debug(f"黑名单更新：{user_id} → 解禁时间戳={unblock_wall}")
+
+    def _ensure_expiry_task(self):
+        """首次拉黑时惰性启动后台过期清理任务"""
+        if self._expiry_task is None or self._expiry_task.done():
+            try:
+                self._expiry_task = asyncio.create_task(self._expiry_loop())
+            except RuntimeError:
+                # 无运行中的事件循环时放弃后台清理，仍有惰性过期兜底
+                pass
+
+    async def _expiry_loop(self):
+        """睡到堆顶到期时间，批量弹出并删除所有已过期的黑名单条目"""
+        while self._expiry_heap:
+            delay = self._expiry_heap[0][0] - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            now = time.monotonic()
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                unblock_mono, uid = heapq.heappop(self._expiry_heap)
+                entry = self.temporary_blacklist.get(uid)
+                # 用户被重新拉黑时堆中旧记录作废，仅删除仍匹配的条目
+                if entry is not None and entry[0] == unblock_mono:
+                    del self.temporary_blacklist[uid]
+                    logger.info("用户 %s 的拉黑已过期，后台自动移除黑名单", uid)
+
+    async def terminate(self):
+        """插件卸载时取消后台任务并落盘未保存的配置"""
+        if self._expiry_task is not None:
+            self._expiry_task.cancel()
+        if self._save_task is not None:
+            self._save_task.cancel()
+        if self._config_dirty:
+            self.config["administrators"] = list(self.administrators)
+            self.config.save_config()
+            self._config_dirty = False
 
     def _extract_target_user(self, message_chain, bot_id):
-        """从消息链提取@的目标用户（排除@Bot自身）"""
-        logger.debug("开始从消息链提取目标用户...")
-        for component in message_chain:
-            if isinstance(component, At):
-                logger.debug(f"发现@组件：qq={component.qq}")
-                if component.qq == "all":
-                    logger.debug("跳过@全体成员")
-                    continue
-                at_id = self._normalize_user_id(component.qq)
-                if at_id != bot_id:  # 忽略@Bot的情况
-                    logger.debug(f"提取到目标用户：{at_id}（排除Bot自身 {bot_id}）")
-                    return at_id
-        logger.debug("未从消息链中提取到有效目标用户（未@任何人或仅@了Bot）")
-        return ""
-
-    def _normalize_user_id(self, user_id):
-        """统一用户ID格式（处理整数/字符串）"""
-        original = user_id
-        if isinstance(user_id, int):
-            normalized = str(user_id)
-        elif isinstance(user_id, str):
-            # 移除可能的前缀（如"qq_"）
-            normalized = user_id.split("_")[-1].strip()
+        """从消息链提取@的目标用户（排除@全体成员和@Bot自身）"""
+        target_id = next(
+            (
+                at_id
+                for component in message_chain
+                if isinstance(component, At)
+                and component.qq != "all"
+                and (at_id := self._normalize_user_id(component.qq)) != bot_id
+            ),
+            "",
+        )
+        if target_id:
+            logger.debug("提取到目标用户：%s（排除Bot自身 %s）", target_id, bot_id)
         else:
-            normalized = str(user_id)
-        logger.debug(f"用户ID规范化：原始={original} → 规范化后={normalized}")
-        return normalized
+            logger.debug("未从消息链中提取到有效目标用户（未@任何人或仅@了Bot）")
+        return target_id
+
+    # 同一用户的ID在每条消息上都会重复规范化，用模块级缓存函数避免重复计算
+    _normalize_user_id = staticmethod(_normalize_user_id)